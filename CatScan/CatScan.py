@@ -25,76 +25,170 @@ import serial
 import time
 import argparse
 import sys
-import re
 import ipaddress
+import os
+import queue
+import collections
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-# Main: builds IP/port lists, opens serial, issues QIOPEN, interprets response codes, and print results
+# +QIOPEN: <connectID>,<err> result URC that ends the wait on a QIOPEN command
+QIOPEN_URC = b'+QIOPEN:'
+
+# Main: builds IP/port lists, opens serial(s), dispatches QIOPEN probes across modems, and print results
 def main():
     args = parse_args()
 
-    # Build IP list
+    # Build IP iterator (CIDR hosts are generated as the scan progresses)
     if args.ip:
-        ips = [args.ip]
+        ips = iter([args.ip])
     elif args.cidr:
         try:
             net = ipaddress.ip_network(args.cidr, strict=False)
-            ips = [str(ip) for ip in net.hosts()]
         except ValueError:
             print(f"Invalid CIDR: {args.cidr}")
             sys.exit(1)
+        ips = (str(ip) for ip in net.hosts())
     else:
-        ips = load_list_from_file(args.ipfile)
+        ips = iter(load_list_from_file(args.ipfile))
 
     # Build ports list
     if args.ports:
-        ports = [p.strip() for p in args.ports.split(',') if p.strip()]
+        raw_ports = [p.strip() for p in args.ports.split(',') if p.strip()]
     else:
-        ports = load_list_from_file(args.portfile)
-
-    # Open serial
-    try:
-        ser = serial.Serial(args.serialport, baudrate=115200, timeout=5)
-    except Exception as e:
-        print(f"Error opening serial port: {e}")
+        raw_ports = load_list_from_file(args.portfile)
+    ports = []
+    for port in raw_ports:
+        try:
+            ports.append(int(port))
+        except ValueError:
+            print(f"Skipping invalid port: {port}")
+    if not ports:
+        print("No valid ports to scan")
         sys.exit(1)
 
-    for ip in ips:
-        seen_valid = False
-        for port in ports:
-            try:
-                port_int = int(port)
-            except ValueError:
-                print(f"Skipping invalid port: {port}")
-                continue
-
-            # Attempt connection
-            resp = send_at_command(ser,
-                                   f'AT+QIOPEN=1,0,"TCP","{ip}",{port_int},0,0')
-            send_at_command(ser, 'AT+QICLOSE=0,10')
-
-            # Parse code2
-            m = re.search(r'\+QIOPEN:\s*\d+,(\d+)', resp)
-            code2 = m.group(1) if m else None
-
-            # Evaluate
-            if code2 == '0':
-                print(f"\033[92m{ip}:{port_int} - OPEN\033[0m")
-                seen_valid = True
-            elif code2 == '566':
-                print(f"\033[33m{ip}:{port_int} - CLOSED\033[0m")
-                seen_valid = True
-            else:
-                # if no valid seen yet, tag host down
-                if not seen_valid:
-                    print(f"\033[91m{ip} - DOWN\033[0m")
+    # Open serial(s), one handle per modem, shared between workers via a queue
+    modems = queue.Queue()
+    handles = []
+    for serialport in [s.strip() for s in args.serialport.split(',') if s.strip()]:
+        try:
+            ser = serial.Serial(serialport, baudrate=115200, timeout=0.1)
+        except Exception as e:
+            print(f"Error opening serial port {serialport}: {e}")
+            sys.exit(1)
+        _tune_serial_latency(ser)
+        handles.append(ser)
+        modems.put(ser)
+
+    # One probe in flight per modem, fed across hosts so a single-port sweep
+    # still keeps every modem busy
+    with ThreadPoolExecutor(max_workers=len(handles)) as pool:
+        hosts = {}     # ip -> scan state for hosts still being probed
+        running = {}   # future -> ip
+        while True:
+            while len(running) < len(handles):
+                work = next_probe(hosts, ips, ports)
+                if work is None:
                     break
-                # else just unknown for this port
-                print(f"\033[93m{ip}:{port_int} - UNKNOWN\033[0m")
+                ip, port = work
+                hosts[ip]['running'] += 1
+                running[pool.submit(probe_with_modem, modems, ip, port)] = ip
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                ip = running.pop(future)
+                host = hosts[ip]
+                host['running'] -= 1
+                _, port_int, code2 = future.result()
 
-            time.sleep(1)
+                # Evaluate
+                if code2 == b'0':
+                    print(f"\033[92m{ip}:{port_int} - OPEN\033[0m")
+                elif code2 == b'566':
+                    print(f"\033[33m{ip}:{port_int} - CLOSED\033[0m")
+                else:
+                    # held back until we know whether the host is up
+                    host['unknown'].append(port_int)
+                    if host['seen_valid']:
+                        report_unknown(ip, host['unknown'])
+                    continue
+
+                if not host['seen_valid']:
+                    host['seen_valid'] = True
+                    report_unknown(ip, host['unknown'])
+
+            # Retire hosts with nothing left in flight that could change their outcome
+            for ip in [ip for ip, host in hosts.items()
+                       if not host['running'] and (not host['ports'] or host_paused(host))]:
+                # every probe that ran failed: tag host down
+                if host_paused(hosts[ip]):
+                    print(f"\033[91m{ip} - DOWN\033[0m")
+                del hosts[ip]
 
-        # next IP
-    ser.close()
+    for ser in handles:
+        ser.close()
+
+# Picks the next (ip, port) to probe: remaining ports of hosts already started
+# come first, then the next host. Returns None when there is nothing to submit
+def next_probe(hosts, ips, ports):
+    for ip, host in hosts.items():
+        if host['ports'] and not host_paused(host):
+            return ip, host['ports'].popleft()
+    for ip in ips:
+        hosts[ip] = {'ports': collections.deque(ports), 'running': 0,
+                     'seen_valid': False, 'unknown': []}
+        return ip, hosts[ip]['ports'].popleft()
+    return None
+
+# A host with a failed probe and no OPEN/CLOSED yet gets no new ports: it is
+# either proven up by a probe still running, or tagged down once they finish
+def host_paused(host):
+    return bool(host['unknown']) and not host['seen_valid']
+
+# Prints (and clears) ports whose probe failed on a host known to be up
+def report_unknown(ip, ports):
+    for port_int in ports:
+        print(f"\033[93m{ip}:{port_int} - UNKNOWN\033[0m")
+    ports.clear()
+
+# Borrows a modem from the shared queue, probes ip:port with it, and returns it to the queue
+def probe_with_modem(modems, ip, port):
+    ser = modems.get()
+    try:
+        return probe(ser, ip, port)
+    finally:
+        modems.put(ser)
+
+# Attempts a single TCP connection via QIOPEN, closes the socket if needed, and returns (ip, port, code2)
+def probe(ser, ip, port):
+    # Attempt connection; the immediate OK only acknowledges the command, so wait for the URC
+    resp = send_at_command(ser,
+                           f'AT+QIOPEN=1,0,"TCP","{ip}",{port},0,0',
+                           terminators=(b'ERROR\r\n', b'+CME ERROR'),
+                           urc=QIOPEN_URC)
+
+    # Parse code2
+    code2 = parse_qiopen_code2(resp)
+
+    # A failed QIOPEN already frees the socket; only close one that opened
+    # (or whose outcome never arrived and may still be pending)
+    if code2 is None or code2 == b'0' or b'CONNECT' in resp:
+        send_at_command(ser, 'AT+QICLOSE=0,10')
+
+    return ip, port, code2
+
+# Pulls code2 out of a "+QIOPEN: <connectID>,<code2>" line; the layout never varies,
+# so a find/split is enough. Returns the code as bytes, or None if no complete URC
+def parse_qiopen_code2(resp):
+    i = resp.find(QIOPEN_URC)
+    if i < 0:
+        return None
+    j = resp.find(b'\r\n', i)
+    if j < 0:
+        return None
+    parts = resp[i + len(QIOPEN_URC):j].split(b',')
+    return parts[1].strip() if len(parts) >= 2 else None
 
 # Parses command-line arguments for target IPs (file, single, or CIDR), ports (file or list), and serial port
 def parse_args():
@@ -113,7 +207,8 @@ def parse_args():
                             help="Comma-separated ports (e.g. 80,443,22)")
 
     parser.add_argument("--serialport", required=True,
-                        help="Serial port for module (e.g. /dev/ttyUSB0)")
+                        help="Serial port(s) for module, comma-separated to scan in parallel "
+                             "(e.g. /dev/ttyUSB0 or /dev/ttyUSB0,/dev/ttyUSB1)")
     return parser.parse_args()
 
 
@@ -126,11 +221,40 @@ def load_list_from_file(filepath):
         print(f"Error reading {filepath}: {e}")
         sys.exit(1)
 
-# Sends an AT command over serial, waits for a response, and returns the decoded string
-def send_at_command(ser, cmd, delay=2):
+# Cuts USB-serial read latency: FTDI latency_timer 16ms -> 1ms via sysfs, else ASYNC_LOW_LATENCY (best effort)
+def _tune_serial_latency(ser):
+    tty = os.path.basename(os.path.realpath(ser.name))
+    try:
+        with open(f"/sys/bus/usb-serial/devices/{tty}/latency_timer", "w") as f:
+            f.write("1")
+        return
+    except OSError:
+        pass
+    try:
+        ser.set_low_latency_mode(True)
+    except (AttributeError, OSError, ValueError):
+        pass
+
+# Sends an AT command over serial and returns the raw response bytes as soon as a
+# terminator (or a complete line starting with urc) arrives, or once timeout seconds have passed
+def send_at_command(ser, cmd, terminators=(b'OK\r\n', b'ERROR\r\n', b'+CME ERROR'),
+                    timeout=2, urc=None):
+    ser.reset_input_buffer()
     ser.write((cmd + '\r\n').encode())
-    time.sleep(delay)
-    return ser.read_all().decode()
+    deadline = time.monotonic() + timeout
+    buf = bytearray()
+    while time.monotonic() < deadline:
+        chunk = ser.read(ser.in_waiting or 1)
+        if not chunk:
+            continue
+        buf.extend(chunk)
+        if any(t in buf for t in terminators):
+            break
+        if urc:
+            i = buf.find(urc)
+            if i >= 0 and buf.find(b'\r\n', i) >= 0:
+                break
+    return bytes(buf)
 
 
 if __name__ == "__main__":
@@ -22,21 +22,36 @@
 #                                                  #
 ####################################################
 
+import asyncio
+import collections
+import contextlib
 import serial
 import socket
 import struct
 import threading
 import time
-import select
 import logging
+import os
+import re
 
 # --- Configuration ---
 SERIAL_PORT     = "/dev/ttyUSB0"
 BAUD_RATE       = 115200
 DEBUG           = True
 MAX_CHUNK_SIZE  = 1024   # bytes per QISEND chunk
+MAX_SOCKETS     = 12     # modem socket IDs handed out to clients (0..MAX_SOCKETS-1)
 PROMPT_TIMEOUT  = 5      # seconds to wait for '>' prompt
 ACK_TIMEOUT     = 5      # seconds to wait for SEND OK
+OPEN_TIMEOUT    = 10     # seconds to wait for the +QIOPEN URC
+CMD_TIMEOUT     = 10     # seconds to wait for OK/ERROR after an AT command
+SEND_WINDOW     = 2      # QISENDs allowed in flight before waiting for SEND OK
+
+# URCs parsed straight off the front of the serial buffer, no decoding
+QIURC_RECV_RE   = re.compile(rb'\+QIURC:\s*"recv",(\d+),(\d+)\r?\n')   # captures <sock_id>, <len>
+QIURC_CLOSED_RE = re.compile(rb'\+QIURC:\s*"closed",(\d+)')            # captures <sock_id>
+QIOPEN_RE       = re.compile(rb'\+QIOPEN:\s*(\d+),(\d+)')               # captures <sock_id>, <err>
+SEND_OK         = b'SEND OK'
+SEND_FAIL       = b'SEND FAIL'
 
 # --- Logging setup ---
 logging.basicConfig(
@@ -46,26 +61,61 @@ logging.basicConfig(
 )
 
 def main():
+    # Bring-up (RDY wait, ATE0) is blocking serial I/O, so it finishes
+    # before the event loop starts.
     modem = QuectelModem(SERIAL_PORT, BAUD_RATE)
-    srv   = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    srv.bind(("0.0.0.0", 1080))
-    srv.listen(5)
+    asyncio.run(serve(modem))
+
+async def serve(modem):
+    """
+    Hook the modem's serial fd into the event loop and serve SOCKS5
+    clients from a single thread. Each client gets its own modem socket
+    ID, so up to MAX_SOCKETS connections can be relayed at once.
+    """
+    loop = asyncio.get_running_loop()
+    modem.attach(loop)
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(("0.0.0.0", 1080))
+    server.listen(MAX_SOCKETS)
+    server.setblocking(False)
     logging.info("CatSocks proxy listening on 0.0.0.0:1080")
 
-    while True:
-        client, addr = srv.accept()
-        logging.info(f"Client connected from {addr}")
-        threading.Thread(
-            target=handle_client,
-            args=(client, modem),
-            daemon=True
-        ).start()
+    clients = set()   # keep client tasks referenced until they finish
+    with server:
+        while True:
+            client_sock, _ = await loop.sock_accept(server)
+            client_sock.setblocking(False)
+            task = loop.create_task(handle_client(client_sock, modem))
+            clients.add(task)
+            task.add_done_callback(clients.discard)
+
+def _tune_serial_latency(ser):
+    """
+    Cut USB-serial read latency. FTDI adapters buffer reads for 16 ms by
+    default; drop their latency_timer to 1 ms via sysfs, otherwise ask the
+    tty driver for ASYNC_LOW_LATENCY. Best effort: failures are ignored.
+    """
+    tty = os.path.basename(os.path.realpath(ser.name))
+    try:
+        with open(f"/sys/bus/usb-serial/devices/{tty}/latency_timer", "w") as f:
+            f.write("1")
+        logging.debug(f"{tty}: latency_timer set to 1 ms")
+        return
+    except OSError:
+        pass
+    try:
+        ser.set_low_latency_mode(True)
+        logging.debug(f"{tty}: ASYNC_LOW_LATENCY enabled")
+    except (AttributeError, OSError, ValueError):
+        pass
 
 class QuectelModem:
-    def __init__(self, port, baud, cid=1, sock_id=0):
-        self.ser     = serial.Serial(port, baud, timeout=None, write_timeout=0)
+    def __init__(self, port, baud, cid=1):
+        self.ser     = serial.Serial(port, baud, timeout=PROMPT_TIMEOUT, write_timeout=0)
+        _tune_serial_latency(self.ser)
         self.cid     = cid
-        self.sock_id = sock_id
 
         # Wait for module to boot
         self._wait_for_rdy()
@@ -81,158 +131,381 @@ class QuectelModem:
                 return
 
     def _send_at(self, cmd, timeout=2):
-        """Send AT command and wait for OK/ERROR."""
+        """Send AT command and wait for OK/ERROR (blocking, start-up only). Returns the raw response bytes."""
         logging.debug(f"→ AT {cmd}")
         self.ser.reset_input_buffer()
         self.ser.write((cmd + "\r").encode())
-        deadline = time.time() + timeout
-        resp = ""
-        while time.time() < deadline:
-            part = self.ser.read(self.ser.in_waiting or 1).decode(errors='ignore')
-            if part:
-                resp += part
-                if "OK" in resp or "ERROR" in resp:
-                    break
-        # Log only the AT response lines
-        for l in resp.splitlines():
-            logging.debug(f"← {l}")
+        resp = bytearray()
+        with self._read_deadline(timeout) as deadline:
+            while time.monotonic() < deadline:
+                part = self.ser.read(self.ser.in_waiting or 1)
+                if part:
+                    # only scan the new bytes (plus a token's worth of overlap)
+                    scan = max(len(resp) - 4, 0)
+                    resp += part
+                    if resp.find(b"OK\r\n", scan) >= 0 or resp.find(b"ERROR", scan) >= 0:
+                        break
+        self._log_response(resp)
         return resp
 
-    def open_tcp_direct_push(self, host, port):
-        """Open a TCP socket in direct‑push mode."""
-        cmd = f'AT+QIOPEN={self.cid},{self.sock_id},"TCP","{host}",{port},0,1'
-        self._send_at(cmd)
-        deadline = time.time() + 10
-        buffer = ""
-        while time.time() < deadline:
-            if self.ser.in_waiting:
-                buffer += self.ser.read(self.ser.in_waiting).decode(errors='ignore')
-                for line in buffer.splitlines():
-                    logging.debug(f"← {line}")
-                    if f"+QIOPEN: {self.sock_id},0" in line or line == "CONNECT":
-                        logging.info("Socket opened.")
-                        return True
-                    if f"+QIOPEN: {self.sock_id}," in line:
-                        logging.error("Socket open failed.")
-                        return False
-            time.sleep(0.1)
-        logging.error("Timeout waiting for socket open.")
-        return False
-
-    def _wait_for_prompt(self):
-        """Block until we see the single-byte '>' prompt."""
-        deadline = time.time() + PROMPT_TIMEOUT
-        while time.time() < deadline:
-            if self.ser.read(1) == b'>':
-                return True
-        return False
-
-    def send_raw(self, data):
+    def _log_response(self, resp):
+        """Log the AT response lines, decoding only when DEBUG is enabled."""
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for l in resp.decode(errors='ignore').splitlines():
+                logging.debug(f"← {l}")
+
+    @contextlib.contextmanager
+    def _read_deadline(self, timeout):
         """
-        Send a binary chunk via QISEND:
-         1) issue QISEND
-         2) wait for '>' prompt
-         3) write payload + Ctrl‑Z
-         4) read and drop exactly one response line (SEND OK or ERROR)
+        Yield a monotonic deadline `timeout` seconds out and arm a watchdog
+        that calls ser.cancel_read() when it passes, so a blocking read
+        returns right at the deadline instead of polling in_waiting.
+        """
+        watchdog = threading.Timer(timeout, self.ser.cancel_read)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            yield time.monotonic() + timeout
+        finally:
+            watchdog.cancel()
+
+    # --- Event-loop side (everything below runs on the asyncio loop) ---
+
+    def attach(self, loop):
+        """
+        Take over the serial fd for the event loop (POSIX only): a single
+        reader callback parses every response and URC and routes it to the
+        command, send or socket waiting for it.
         """
-        # 1) issue QISEND
-        at = f"AT+QISEND={self.sock_id},{len(data)}\r"
-        self.ser.write(at.encode())
-
-        # 2) wait for '>' prompt
-        if not self._wait_for_prompt():
-            raise TimeoutError("No '>' prompt")
-
-        # 3) write data
-        self.ser.write(data)
-        self.ser.write(b'\x1A')
-
-        # 4) consume one response line
-        deadline = time.time() + ACK_TIMEOUT
-        line = b""
-        while time.time() < deadline:
-            ch = self.ser.read(1)
-            if not ch:
+        self.loop      = loop
+        self.fd        = self.ser.fileno()
+        self.lock      = asyncio.Lock()          # one AT command / QISEND on the wire at a time
+        self.rx        = bytearray()             # unparsed bytes read off the serial fd
+        self.free_ids  = list(range(MAX_SOCKETS))
+        self.inboxes   = {}                      # sock_id -> asyncio.Queue of payloads (None = closed)
+        self.opening   = {}                      # sock_id -> future for its +QIOPEN result
+        self.result    = None                    # future for the pending command's OK/ERROR
+        self.prompt    = None                    # future for the pending QISEND '>' prompt
+        self.unacked   = collections.deque()     # sock_id of each QISEND written but not yet acked
+        self.acked     = asyncio.Event()         # set by the reader whenever an ack frees a window slot
+        self.sends     = set()                   # in-progress QISEND tasks (kept referenced)
+        self.lost      = None                    # ConnectionError once the serial port is gone
+        self.ser.reset_input_buffer()
+        loop.add_reader(self.fd, self._on_readable)
+
+    def _on_readable(self):
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                self._lose(e)
+                return
+            if not data:
+                self._lose("hangup")
+                return
+            self.rx += data
+        self._parse()
+
+    def _lose(self, reason):
+        """
+        The serial port is gone (hangup, or EIO on USB unplug): stop watching
+        the fd and fail everything waiting on the modem so sessions shut down.
+        """
+        if self.lost:
+            return
+        logging.error(f"Serial port lost: {reason}")
+        self.loop.remove_reader(self.fd)
+        self.lost = ConnectionError(f"serial port lost: {reason}")
+        for future in (self.result, self.prompt, *self.opening.values()):
+            _fail(future, self.lost)
+        for inbox in self.inboxes.values():
+            inbox.put_nowait(None)
+        self.unacked.clear()
+        self.acked.set()
+
+    def _parse(self):
+        """
+        Consume every complete frame at the front of rx. A partial line or
+        payload stays in rx for the next read.
+        """
+        rx = self.rx
+        while rx:
+            m = QIURC_RECV_RE.match(rx)
+            if m:
+                # take exactly <len> bytes following the header
+                start = m.end()
+                end   = start + int(m.group(2))
+                if len(rx) < end:
+                    return
+                inbox = self.inboxes.get(int(m.group(1)))
+                if inbox:
+                    inbox.put_nowait(bytes(rx[start:end]))
+                del rx[:end]
+                continue
+
+            if rx.startswith(b'>'):
+                del rx[:2 if rx.startswith(b'> ') else 1]
+                _resolve(self.prompt, True)
                 continue
-            line += ch
-            if line.endswith(b"\r\n"):
-                # drop it silently
+
+            eol = rx.find(b"\n")
+            if eol < 0:
                 return
-        raise TimeoutError("Timeout waiting for QISEND response")
+            line = bytes(rx[:eol]).strip()
+            del rx[:eol+1]
+            if not line:
+                continue
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"← {line.decode(errors='ignore')}")
+
+            if line == b"OK":
+                _resolve(self.result, line)
+            elif line.startswith(b"ERROR") or line.startswith(b"+CME ERROR"):
+                # the modem answers in wire order: an outstanding payload was
+                # written before any command still waiting, so it goes first
+                if self.unacked:
+                    logging.error("QISEND payload rejected with ERROR")
+                    self._ack()
+                elif self.prompt and not self.prompt.done():
+                    _resolve(self.prompt, False)
+                else:
+                    _resolve(self.result, line)
+            elif line.startswith(SEND_OK) or line.startswith(SEND_FAIL):
+                if line.startswith(SEND_FAIL):
+                    logging.error("QISEND reported SEND FAIL")
+                self._ack()
+            elif (m := QIOPEN_RE.match(line)):
+                _resolve(self.opening.get(int(m.group(1))), int(m.group(2)))
+            elif (m := QIURC_CLOSED_RE.match(line)):
+                inbox = self.inboxes.get(int(m.group(1)))
+                if inbox:
+                    inbox.put_nowait(None)
+
+    def _ack(self):
+        """Retire the oldest outstanding QISEND and wake a sender waiting on the window."""
+        if self.unacked:
+            self.unacked.popleft()
+        self.acked.set()
+
+    async def _write(self, data):
+        """Write all of data to the (non-blocking) serial fd, yielding to the loop on EAGAIN."""
+        if self.lost:
+            raise self.lost
+        view = memoryview(data)
+        while view:
+            try:
+                n = os.write(self.fd, view)
+            except BlockingIOError:
+                writable = self.loop.create_future()
+                self.loop.add_writer(self.fd, _resolve, writable, True)
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(self.fd)
+                continue
+            except OSError as e:
+                self._lose(e)
+                raise self.lost
+            view = view[n:]
+
+    async def command(self, cmd, timeout=CMD_TIMEOUT):
+        """Send an AT command and return its final OK/ERROR line (None on timeout)."""
+        async with self.lock:
+            logging.debug(f"→ AT {cmd}")
+            self.result = self.loop.create_future()
+            await self._write((cmd + "\r").encode())
+            try:
+                return await asyncio.wait_for(self.result, timeout)
+            except asyncio.TimeoutError:
+                return None
+            finally:
+                self.result = None
+
+    async def open_tcp_direct_push(self, host, port):
+        """Open a TCP socket in direct‑push mode. Returns its sock_id, or None on failure."""
+        if not self.free_ids:
+            logging.error("No free modem socket IDs.")
+            return None
+        sock_id = self.free_ids.pop(0)
+        self.opening[sock_id] = self.loop.create_future()
+        self.inboxes[sock_id] = asyncio.Queue()
+        try:
+            cmd  = f'AT+QIOPEN={self.cid},{sock_id},"TCP","{host}",{port},0,1'
+            resp = await self.command(cmd)
+            if resp == b"OK":
+                err = await asyncio.wait_for(self.opening[sock_id], OPEN_TIMEOUT)
+                if err == 0:
+                    logging.info(f"Socket {sock_id} opened.")
+                    return sock_id
+                logging.error(f"Socket {sock_id} open failed ({err}).")
+            else:
+                logging.error(f"Socket {sock_id} open failed.")
+        except asyncio.TimeoutError:
+            logging.error(f"Timeout waiting for socket {sock_id} open.")
+        except ConnectionError as e:
+            logging.error(f"Socket {sock_id} open failed: {e}")
+        finally:
+            self.opening.pop(sock_id, None)
+        await self.close_tcp(sock_id)
+        return None
+
+    async def send_raw(self, sock_id, data):
+        """
+        Send a binary chunk (bytes or any buffer, e.g. a memoryview) via QISEND:
+         1) wait for a free slot in the SEND_WINDOW, then issue QISEND
+         2) wait for '>' prompt
+         3) write payload + Ctrl‑Z
+        The SEND OK is not waited for here, so the next chunk's QISEND can
+        go out while this one is still being transmitted.
+
+        The exchange is shielded: once QISEND is on the wire the modem
+        expects exactly len(data) bytes, so cancelling the caller (e.g. the
+        relay shutting down) must not cut it short.
+        """
+        send = self.loop.create_task(self._send_chunk(sock_id, data))
+        self.sends.add(send)
+        send.add_done_callback(self._send_done)
+        await asyncio.shield(send)
+
+    def _send_done(self, send):
+        self.sends.discard(send)
+        # retrieve the outcome so a send orphaned by cancellation doesn't log "never retrieved"
+        if not send.cancelled() and send.exception():
+            logging.debug(f"QISEND failed: {send.exception()}")
 
-    def close_tcp(self):
-        self._send_at(f"AT+QICLOSE={self.sock_id},10")
+    async def _send_chunk(self, sock_id, data):
+        async with self.lock:
+            # window check and slot claim happen under the same lock
+            while len(self.unacked) >= SEND_WINDOW:
+                self.acked.clear()
+                try:
+                    await asyncio.wait_for(self.acked.wait(), ACK_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # the oldest ack was lost; give its slot back rather than wedge every client
+                    logging.error("Timeout waiting for QISEND response")
+                    self.unacked.popleft()
 
-def handle_client(client_sock, modem):
+            self.prompt = self.loop.create_future()
+            try:
+                await self._write(f"AT+QISEND={sock_id},{len(data)}\r".encode())
+                if not await asyncio.wait_for(self.prompt, PROMPT_TIMEOUT):
+                    raise ConnectionError(f"QISEND refused on socket {sock_id}")
+            except asyncio.TimeoutError:
+                raise TimeoutError("No '>' prompt")
+            finally:
+                self.prompt = None
+            await self._write(data)
+            await self._write(b'\x1A')
+            self.unacked.append(sock_id)
+
+    async def close_tcp(self, sock_id):
+        if not self.lost:
+            await self.command(f"AT+QICLOSE={sock_id},10")
+        self.inboxes.pop(sock_id, None)
+        # acks still owed to this socket will never matter to anyone; free their slots
+        if sock_id in self.unacked:
+            self.unacked = collections.deque(s for s in self.unacked if s != sock_id)
+            self.acked.set()
+        if sock_id not in self.free_ids:
+            self.free_ids.append(sock_id)
+
+def _resolve(future, value):
+    """Complete a waiter future unless it is missing or already done."""
+    if future and not future.done():
+        future.set_result(value)
+
+def _fail(future, exc):
+    """Fail a waiter future unless it is missing or already done."""
+    if future and not future.done():
+        future.set_exception(exc)
+        # mark retrieved: a waiter may never come back for it (e.g. a +QIOPEN
+        # whose QIOPEN command failed first), awaiting it still raises
+        future.exception()
+
+async def _recv_exactly(loop, sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        count = await loop.sock_recv_into(sock, view[got:])
+        if not count:
+            raise asyncio.IncompleteReadError(bytes(buf[:got]), n)
+        got += count
+    return buf
+
+async def handle_client(client_sock, modem):
+    loop = asyncio.get_running_loop()
+    sock_id = None
     try:
         # --- SOCKS5 handshake ---
-        ver, nmethods = struct.unpack("!BB", client_sock.recv(2))
-        client_sock.recv(nmethods)
-        client_sock.sendall(b"\x05\x00")
+        ver, nmethods = struct.unpack("!BB", await _recv_exactly(loop, client_sock, 2))
+        await _recv_exactly(loop, client_sock, nmethods)
+        await loop.sock_sendall(client_sock, b"\x05\x00")
 
         # --- CONNECT request ---
-        hdr = client_sock.recv(4)
+        hdr = await _recv_exactly(loop, client_sock, 4)
         _, cmd, _, atyp = struct.unpack("!BBBB", hdr)
         if cmd != 1:
             return
         if atyp == 1:      # IPv4
-            addr = socket.inet_ntoa(client_sock.recv(4))
+            addr = socket.inet_ntoa(bytes(await _recv_exactly(loop, client_sock, 4)))
         elif atyp == 3:    # Domain
-            alen = client_sock.recv(1)[0]
-            addr = client_sock.recv(alen).decode()
+            alen = (await _recv_exactly(loop, client_sock, 1))[0]
+            addr = (await _recv_exactly(loop, client_sock, alen)).decode()
         else:
             return
-        port = struct.unpack("!H", client_sock.recv(2))[0]
+        port = struct.unpack("!H", await _recv_exactly(loop, client_sock, 2))[0]
         logging.info(f"CONNECT {addr}:{port}")
 
         # --- Open TCP socket ---
-        if not modem.open_tcp_direct_push(addr, port):
-            client_sock.sendall(b"\x05\x01\x00\x01" + b"\x00"*6)
+        sock_id = await modem.open_tcp_direct_push(addr, port)
+        if sock_id is None:
+            await loop.sock_sendall(client_sock, b"\x05\x01\x00\x01" + b"\x00"*6)
             return
-        client_sock.sendall(b"\x05\x00\x00\x01" + b"\x00"*6)
-
-        # --- Relay loop ---
-        client_fd  = client_sock.fileno()
-        serial_fd  = modem.ser.fileno()
-        client_sock.setblocking(False)
+        await loop.sock_sendall(client_sock, b"\x05\x00\x00\x01" + b"\x00"*6)
 
-        while True:
-            rlist, _, _ = select.select([client_fd, serial_fd], [], [])
-
-            # a) Client → Modem
-            if client_fd in rlist:
-                data = client_sock.recv(4096)
-                if not data:
-                    break
-                # send in MAX_CHUNK_SIZE slices
-                offset = 0
-                while offset < len(data):
-                    chunk = data[offset:offset+MAX_CHUNK_SIZE]
-                    offset += len(chunk)
-                    logging.info(f"Client→Modem: {len(chunk)} bytes")
-                    modem.send_raw(chunk)
-
-            # b) Modem → Client
-            if serial_fd in rlist:
-                # read URC header line
-                line = modem.ser.readline().decode(errors='ignore').strip()
-                if line.startswith('+QIURC') and 'recv' in line:
-                    # parse length and read exactly that many bytes
-                    length = int(line.split(',')[-1])
-                    payload = b''
-                    while len(payload) < length:
-                        payload += modem.ser.read(length - len(payload))
-                    logging.info(f"Modem→Client: {len(payload)} bytes")
-                    client_sock.sendall(payload)
-                elif 'closed' in line:
-                    logging.info("Remote closed")
-                    break
-
-        modem.close_tcp()
+        # --- Relay: one task per direction, stop when either side closes ---
+        tasks = [
+            asyncio.ensure_future(_client_to_modem(loop, client_sock, modem, sock_id)),
+            asyncio.ensure_future(_modem_to_client(loop, client_sock, modem.inboxes[sock_id])),
+        ]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
 
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, TimeoutError) as e:
+        logging.debug(f"Client error: {e}")
     finally:
+        if sock_id is not None:
+            await modem.close_tcp(sock_id)
         client_sock.close()
 
+async def _client_to_modem(loop, client_sock, modem, sock_id):
+    # one receive buffer per client, reused for every read; send_raw has
+    # written the payload out by the time it returns, so it is free again
+    view = memoryview(bytearray(4096))
+    while True:
+        count = await loop.sock_recv_into(client_sock, view)
+        if not count:
+            return
+        # send in MAX_CHUNK_SIZE slices, without copying
+        for offset in range(0, count, MAX_CHUNK_SIZE):
+            chunk = view[offset:min(offset+MAX_CHUNK_SIZE, count)]
+            logging.info(f"Client→Modem [{sock_id}]: {len(chunk)} bytes")
+            await modem.send_raw(sock_id, chunk)
+
+async def _modem_to_client(loop, client_sock, inbox):
+    while True:
+        payload = await inbox.get()
+        if payload is None:
+            logging.info("Remote closed")
+            return
+        logging.info(f"Modem→Client: {len(payload)} bytes")
+        await loop.sock_sendall(client_sock, payload)
+
 if __name__ == "__main__":
     main()
-
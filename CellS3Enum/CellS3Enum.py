@@ -6,17 +6,41 @@ import os
 import argparse
 import serial
 import sys
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 stop_event = False
 
+QHTTPGET_RE = re.compile(rb'\+QHTTPGET:\s*0,(\d+)')
+CONNECTION_CLOSE_RE = re.compile(r'^connection:\s*close', re.IGNORECASE | re.MULTILINE)
+
+def _tune_serial_latency(ser):
+    # FTDI adapters buffer reads for 16 ms by default; drop to 1 ms, else try ASYNC_LOW_LATENCY
+    tty = os.path.basename(os.path.realpath(ser.name))
+    try:
+        with open(f"/sys/bus/usb-serial/devices/{tty}/latency_timer", "w") as f:
+            f.write("1")
+        return
+    except OSError:
+        pass
+    try:
+        ser.set_low_latency_mode(True)
+    except (AttributeError, OSError, ValueError):
+        pass
+
 class EG91HTTPSClient:
     def __init__(self, port, baudrate=115200, require_rdy=True, verbose=False):
         self.verbose = verbose
-        self.ser = serial.Serial(port, baudrate, timeout=1)
+        self.ser = serial.Serial(port, baudrate, timeout=0.2)  # per-read cap; callers track the overall deadline
+        _tune_serial_latency(self.ser)
+        self.session_host = None
+        self.request_tail = b""
         self.flush()
         if require_rdy:
             self.wait_for_ready()
+        self.configure()
 
     def close(self):
         if self.ser and self.ser.is_open:
@@ -28,64 +52,98 @@ class EG91HTTPSClient:
 
     def wait_for_ready(self, timeout=60):
         print("[MODEM] Waiting for RDY from Quectel Cell Module...")
-        start = time.time()
-        while time.time() - start < timeout:
-            if self.ser.in_waiting:
-                line = self.ser.readline().decode(errors="ignore").strip()
-                if self.verbose:
-                    print(f"[MODEM] << {line}")
-                if "RDY" in line:
-                    print("[MODEM] RDY detected.")
-                    return
-            time.sleep(0.1)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            line = self.ser.readline()
+            if not line:
+                continue
+            if self.verbose:
+                print(f"[MODEM] << {line.decode(errors='ignore').strip()}")
+            if b"RDY" in line:
+                print("[MODEM] RDY detected.")
+                return
         print("[MODEM] Warning: RDY not detected within timeout. Trying AT fallback...")
         resp = self.send_at("AT", wait="OK", timeout=5)
         if "OK" not in resp:
             raise RuntimeError("Modem not responsive.")
 
+    def configure(self):
+        # We write the request header ourselves (keep-alive) and read back the response header
+        self.send_at('AT+QHTTPCFG="sslctxid",1')
+        self.send_at('AT+QHTTPCFG="requestheader",1')
+        self.send_at('AT+QHTTPCFG="responseheader",1')
+
     def send_at(self, cmd, wait="OK", timeout=10):
         if self.verbose:
             print(f"[MODEM] >> {cmd}")
         self.ser.write((cmd + "\r").encode())
-        buffer = ""
-        start = time.time()
-        while time.time() - start < timeout:
-            if self.ser.in_waiting:
-                line = self.ser.readline().decode(errors="ignore")
-                buffer += line
-                if self.verbose:
-                    print(f"[MODEM] << {line.strip()}")
-                if wait in line:
-                    break
-            time.sleep(0.1)
-        return buffer.strip()
-
-    def https_get(self, url):
-        print(f"[MODEM] HTTPS GET: {url}")
+        return self.read_response(wait, timeout)
+
+    def read_response(self, wait="OK", timeout=10):
+        return self._read_until(wait.encode(), timeout).decode(errors="ignore").strip()
+
+    def _read_until(self, token, timeout):
+        # readline() is capped by the port timeout, so a line (and the token in it)
+        # can arrive in pieces: search the accumulated buffer, not the last piece,
+        # and return once the line holding the token is complete
+        buffer = bytearray()
+        found = -1
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            line = self.ser.readline()
+            if not line:
+                continue
+            scan = max(len(buffer) - len(token) + 1, 0)
+            buffer.extend(line)
+            if self.verbose:
+                print(f"[MODEM] << {line.decode(errors='ignore').strip()}")
+            if found < 0:
+                found = buffer.find(token, scan)
+            if found >= 0 and buffer.find(b"\n", found) >= 0:
+                break
+        return buffer
+
+    def open_session(self, host):
+        url = f"https://{host}/"
         resp = self.send_at(f'AT+QHTTPURL={len(url)},30', wait="CONNECT")
         if "CONNECT" not in resp:
             raise Exception(f"Failed at QHTTPURL: {resp}")
-        self.ser.write((url + '\x1A').encode())
-        time.sleep(2)
-        self.send_at("AT+QHTTPGET=60")
-        buffer = ""
-        start = time.time()
-        while time.time() - start < 30:
-            if self.ser.in_waiting:
-                line = self.ser.readline().decode(errors="ignore").strip()
-                buffer += line + "\n"
-                if self.verbose:
-                    print(f"[MODEM] << {line}")
-                if "+QHTTPGET:" in line:
-                    break
-            time.sleep(0.1)
-
-        code_match = re.search(r'\+QHTTPGET: 0,(\d+)', buffer)
+        self.ser.write(url.encode())
+        resp = self.read_response("OK", timeout=30)
+        if "OK" not in resp:
+            raise Exception(f"Failed at QHTTPURL: {resp}")
+        self.session_host = host
+        # everything after the request path is fixed for the session
+        self.request_tail = (f" HTTP/1.1\r\nHost: {host}\r\n"
+                             "Connection: keep-alive\r\n\r\n").encode()
+
+    def https_get(self, host, path, url):
+        # url is only logged; the caller already built it from a per-bucket prefix
+        print(f"[MODEM] HTTPS GET: {url}")
+        if host != self.session_host:
+            self.open_session(host)
+
+        request = b"GET /" + path.encode() + self.request_tail
+        resp = self.send_at(f"AT+QHTTPGET=60,{len(request)}", wait="CONNECT")
+        if "CONNECT" not in resp:
+            self.session_host = None
+            raise Exception(f"Failed at QHTTPGET: {resp}")
+        self.ser.write(request)
+        buffer = self._read_until(b"+QHTTPGET:", timeout=30)
+
+        code_match = QHTTPGET_RE.search(buffer)
         if not code_match:
-            raise Exception(f"No valid +QHTTPGET response: {buffer.strip()}")
+            self.session_host = None
+            raise Exception(f"No valid +QHTTPGET response: {buffer.decode(errors='ignore').strip()}")
 
         code = int(code_match.group(1))
-        body = self.send_at("AT+QHTTPREAD=30", wait="OK", timeout=10)
+        resp = self.send_at("AT+QHTTPREAD=30", wait="+QHTTPREAD:", timeout=10)
+        header, sep, body = resp.partition("\r\n\r\n")
+        if not sep:
+            body = resp
+        elif CONNECTION_CLOSE_RE.search(header):
+            # Server won't keep the connection; start a fresh session on the next request
+            self.session_host = None
         if self.verbose:
             print(f"[MODEM] Response Body (truncated):\n{body[:500]}")
         return code, body
@@ -117,7 +175,8 @@ This probes URLs like:
     parser.add_argument("--wordlist", required=True, help="List of base object names to try")
     parser.add_argument("--extensions", nargs="+", default=["txt"], help="File extensions to append (e.g. txt json html)")
     parser.add_argument("--s3-endpoint", default="s3.amazonaws.com", help="S3 endpoint (default: s3.amazonaws.com)")
-    parser.add_argument("--serial-port", default="/dev/ttyUSB0", help="Modem serial port")
+    parser.add_argument("--serial-port", default="/dev/ttyUSB0",
+                        help="Modem serial port(s), comma-separated to probe in parallel (e.g. /dev/ttyUSB0,/dev/ttyUSB1)")
     parser.add_argument("--baudrate", type=int, default=115200, help="Baud rate")
     parser.add_argument("--assume-on", action="store_true", help="Skip RDY wait")
     parser.add_argument("--verbose", action="store_true", help="Verbose logging")
@@ -132,52 +191,85 @@ This probes URLs like:
     with open(args.wordlist, "r") as f:
         raw_objects = [line.strip() for line in f if line.strip()]
 
-    objects = []
+    extensions = tuple(args.extensions)
+    objects = {}  # ordered and unique
     for base in raw_objects:
-        for ext in args.extensions:
-            objects.append(f"{base}.{ext}")
-    objects = list(dict.fromkeys(objects))  # ordered and unique
-
-    modem = EG91HTTPSClient(args.serial_port, args.baudrate, require_rdy=not args.assume_on, verbose=args.verbose)
-    results = []
-
-    for bucket in buckets:
-        for obj in objects:
-            url = f"https://{bucket}.{args.s3_endpoint}/{obj}"
-            try:
-                status, response = modem.https_get(url)
-                results.append({
-                    "bucket": bucket,
-                    "object": obj,
-                    "url": url,
-                    "status": status,
-                    "body": response[:200],
-                    "timestamp": datetime.utcnow().isoformat()
-                })
-                if status == 200:
-                    print(color_text(f"SUCCESS {url} → HTTP {status}", "32"))  # green
-                elif status == 404:
-                    print(color_text(f"NOT FOUND {url} → HTTP {status}", "33"))  # yellow
-                else:
-                    print(color_text(f"RESPONSE {url} → HTTP {status}", "36"))  # cyan
-            except Exception as e:
-                print(color_text(f"ERROR {url} → {e}", "31"))  # red
-                results.append({
-                    "bucket": bucket,
-                    "object": obj,
-                    "url": url,
-                    "status": "error",
-                    "error": str(e),
-                    "timestamp": datetime.utcnow().isoformat()
-                })
-            time.sleep(1)
-
-    modem.close()
-
-    out_file = "s3_enum_results.json"
-    with open(out_file, "w") as f:
-        json.dump(results, f, indent=2)
+        for ext in extensions:
+            # words that already carry this extension are used as-is
+            obj = base if base.endswith(f".{ext}") else f"{base}.{ext}"
+            objects.setdefault(obj, None)
+
+    # One client per modem, shared between workers via a queue
+    clients = [EG91HTTPSClient(port, args.baudrate, require_rdy=not args.assume_on, verbose=args.verbose)
+               for port in (p.strip() for p in args.serial_port.split(",")) if port]
+    modems = queue.Queue()
+    for modem in clients:
+        modems.put(modem)
+
+    # One JSON record per line, written by a single thread as workers finish
+    out_file = "s3_enum_results.jsonl"
+    results = queue.Queue()
+    writer = threading.Thread(target=write_results, args=(out_file, results), daemon=True)
+    writer.start()
+
+    # Cap queued work so a huge wordlist isn't turned into futures all at once
+    slots = threading.BoundedSemaphore(len(clients) * 2)
+    try:
+        with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+            for bucket in buckets:
+                host = f"{bucket}.{args.s3_endpoint}"
+                prefix = f"https://{host}/"
+                for obj in objects:
+                    slots.acquire()
+                    future = pool.submit(probe, modems, results, bucket, host, obj, prefix + obj)
+                    future.add_done_callback(lambda _: slots.release())
+    finally:
+        results.put(None)
+        writer.join()
+        for modem in clients:
+            modem.close()
     print(color_text(f"[DONE] Results saved to {out_file}", "34"))  # blue
 
+def probe(modems, results, bucket, host, obj, url):
+    modem = modems.get()
+    try:
+        status, response = modem.https_get(host, obj, url)
+        record = {
+            "bucket": bucket,
+            "object": obj,
+            "url": url,
+            "status": status,
+            "body": response[:200],
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        if status == 200:
+            print(color_text(f"SUCCESS {url} → HTTP {status}", "32"))  # green
+        elif status == 404:
+            print(color_text(f"NOT FOUND {url} → HTTP {status}", "33"))  # yellow
+        else:
+            print(color_text(f"RESPONSE {url} → HTTP {status}", "36"))  # cyan
+    except Exception as e:
+        print(color_text(f"ERROR {url} → {e}", "31"))  # red
+        record = {
+            "bucket": bucket,
+            "object": obj,
+            "url": url,
+            "status": "error",
+            "error": str(e),
+            "timestamp": datetime.utcnow().isoformat()
+        }
+    finally:
+        modems.put(modem)
+    results.put(record)
+
+def write_results(out_file, results):
+    # line-buffered so partial results survive Ctrl-C or a crash
+    with open(out_file, "w", buffering=1) as out:
+        while True:
+            record = results.get()
+            if record is None:
+                return
+            out.write(json.dumps(record) + "\n")
+
 if __name__ == "__main__":
     main()